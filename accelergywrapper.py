@@ -8,21 +8,34 @@ from accelergy.plug_in_interface.estimator_wrapper import (
     SupportedComponent,
     PrintableCall,
 )
-from typing import Dict, List, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
+import atexit
 import os
 import sys
+import time
 
 # fmt: off for Black formatter
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(SCRIPT_DIR)
 from scaling import *
 from helper_functions import *
+from query_trace import *
 
 # fmt: on
 
 AREA_ACCURACY = 90
 ENERGY_ACCURACY = 90
 
+# Estimators whose query traces are written to ACCELERGY_LIBRARY_PROFILE_OUTPUT
+# on exit. A single exit hook covers every instance so they share one file.
+_PROFILED_ESTIMATORS = []
+
+
+def _export_profiled_query_traces(path: str, fmt: str):
+    traces = [t for e in _PROFILED_ESTIMATORS for t in e.query_traces]
+    write_query_traces(traces, path, fmt)
+
+
 # =============================================================================
 # Wrapper Class
 # =============================================================================
@@ -34,6 +47,19 @@ class LibraryEstimator(AccelergyPlugIn):
         super().__init__()
         self.components = []
 
+        # Scaling-profile mode. ACCELERGY_LIBRARY_PROFILE enables per-query
+        # traces ("chrome" selects Chrome trace format for export), and
+        # ACCELERGY_LIBRARY_PROFILE_OUTPUT writes them to a file on exit.
+        profile = os.environ.get("ACCELERGY_LIBRARY_PROFILE", "")
+        self.profile = profile.lower() not in ["", "0", "false"]
+        self.query_traces: List[QueryTrace] = []
+        profile_output = os.environ.get("ACCELERGY_LIBRARY_PROFILE_OUTPUT", "")
+        if self.profile and profile_output:
+            fmt = "chrome" if profile.lower() == "chrome" else "json"
+            if not _PROFILED_ESTIMATORS:
+                atexit.register(_export_profiled_query_traces, profile_output, fmt)
+            _PROFILED_ESTIMATORS.append(self)
+
         component_files = [
             os.path.join(root, f)
             for root, _, files in os.walk(os.path.join(SCRIPT_DIR, "library"))
@@ -139,11 +165,16 @@ class LibraryEstimator(AccelergyPlugIn):
                 )
 
     def primitive_action_supported(self, query: AccelergyQuery) -> AccuracyEstimation:
-        success = self.get_energy_or_area(query, log_scaling=False) is not None
+        success = (
+            self.get_energy_or_area(query, log_scaling=False, support_check=True)
+            is not None
+        )
         return AccuracyEstimation(ENERGY_ACCURACY if success else 0)
 
     def primitive_area_supported(self, query: AccelergyQuery) -> AccuracyEstimation:
-        success = self.estimate_area(query, log_scaling=False) is not None
+        success = (
+            self.estimate_area(query, log_scaling=False, support_check=True) is not None
+        )
         return AccuracyEstimation(AREA_ACCURACY if success else 0)
 
     def estimate_energy(self, query: AccelergyQuery, **kwargs) -> Estimation:
@@ -161,9 +192,11 @@ class LibraryEstimator(AccelergyPlugIn):
         entry: Dict[str, str],
         target: str,
         log_scaling: bool,
+        trace: Optional[EntryTrace] = None,
     ) -> Tuple[Union[float, None], int, List[str]]:
         """Matches a query to an entry in the library. Returns the energy/area
-        scale, the number of matching attributes, and a log."""
+        scale, the number of matching attributes, and a log. If a trace is
+        given, matched attributes and scaling steps are recorded into it."""
         class_name = query.class_name.lower()
         class_attrs = query.class_attrs
         scale, log = 1, []
@@ -200,13 +233,30 @@ class LibraryEstimator(AccelergyPlugIn):
                 log.append(f"Scaling {a} from {entry_val} to {class_attrs[a]}")
                 attrs_to_scale.append(a)
 
+        if trace is not None:
+            trace.attrs_to_scale = list(attrs_to_scale)
+
         # Scale the attributes that must be scaled
         try:
             # Try to scale the attributes that must be scaled
             for a in attrs_to_scale:
+                scalefrom, scaleto = None, None
+                if trace is not None:
+                    start = time.perf_counter()
                 scalefrom = parse_float(entry[class2entry[a]], f"{class_name}.{a}")
                 scaleto = parse_float(class_attrs[a], f"{class_name}.{a}")
                 s = scale_energy_or_area(a, scalefrom, scaleto, target)
+                if trace is not None:
+                    trace.scaling_steps.append(
+                        ScalingStep(
+                            a,
+                            scalefrom,
+                            scaleto,
+                            s,
+                            time.perf_counter() - start,
+                            start=start,
+                        )
+                    )
 
                 if s == 1:
                     matching_attrs.append(a)
@@ -221,7 +271,23 @@ class LibraryEstimator(AccelergyPlugIn):
         except (ValueError, ZeroDivisionError) as e:
             scale = None
             self.logger.info(f"Failed to scale {class_name}: {str(e).strip()}")
+            if trace is not None:
+                trace.error = str(e).strip()
+                trace.scaling_steps.append(
+                    ScalingStep(
+                        a,
+                        scalefrom,
+                        scaleto,
+                        None,
+                        time.perf_counter() - start,
+                        error=trace.error,
+                        start=start,
+                    )
+                )
 
+        if trace is not None:
+            trace.matching_attrs = list(matching_attrs)
+            trace.scale = scale
         return scale, len(matching_attrs), log
 
     def get_energy_or_area(
@@ -229,6 +295,7 @@ class LibraryEstimator(AccelergyPlugIn):
         query: AccelergyQuery,
         is_energy: bool = True,
         log_scaling: bool = True,
+        support_check: bool = False,
     ) -> Estimation:
         class_name = query.class_name.lower()
         # For finding closest-matching component
@@ -238,6 +305,17 @@ class LibraryEstimator(AccelergyPlugIn):
         if query.action_name == "leak":
             target = "leak"
 
+        trace = None
+        if self.profile:
+            trace = QueryTrace(
+                class_name,
+                query.action_name.lower() if is_energy else None,
+                target,
+                dict(query.class_attrs),
+                support_check,
+            )
+            self.query_traces.append(trace)
+
         if is_energy:
             action_name = query.action_name.lower()
             entries = self.action2entry.get((class_name, action_name), [])
@@ -248,25 +326,51 @@ class LibraryEstimator(AccelergyPlugIn):
             entries = self.name2entry.get(class_name, [])
             self.logger.info(f"Found {len(entries)} entries for {class_name}.")
 
-        for entry in entries:
-            scale, matching_attrs, log = self.match_entry(
-                query, entry, target, log_scaling
-            )
-            if scale is None:
-                continue
-
-            # Scaled successfully! Now get the value
-            if log_scaling:
-                log.append(f"{class_name} {target} has been scaled {scale}x")
-
-            value = get_value_from_entry(entry, get_value)
-            self.logger.info(f"{value=}, {matching_attrs=}, {log=}")
-
-            if value is not None and matching_attrs > best_matches:
-                best_value = value * scale
-                best_matches = matching_attrs
-                best_log = log
-                best_entry = entry
+        entry_trace = None
+        try:
+            for entry in entries:
+                entry_trace = trace.new_entry(entry) if trace is not None else None
+                scale, matching_attrs, log = self.match_entry(
+                    query, entry, target, log_scaling, entry_trace
+                )
+                if scale is None:
+                    if entry_trace is not None:
+                        entry_trace.finish()
+                    continue
+
+                # Scaled successfully! Now get the value
+                if log_scaling:
+                    log.append(f"{class_name} {target} has been scaled {scale}x")
+
+                value = get_value_from_entry(entry, get_value)
+                self.logger.info(f"{value=}, {matching_attrs=}, {log=}")
+                if entry_trace is not None:
+                    entry_trace.value = value
+                    entry_trace.finish()
+
+                if value is not None and matching_attrs > best_matches:
+                    best_value = value * scale
+                    best_matches = matching_attrs
+                    best_log = log
+                    best_entry = entry
+                    if trace is not None:
+                        trace.best_index = entry_trace.index
+        except Exception as e:
+            if entry_trace is not None:
+                entry_trace.error = str(e).strip()
+                entry_trace.finish()
+            if trace is not None:
+                trace.error = str(e).strip()
+                trace.best_index = None
+            raise
+        else:
+            if trace is not None:
+                trace.result = best_value
+                if best_value is None:
+                    trace.error = f"Could not find {target} for {class_name}"
+        finally:
+            if trace is not None:
+                trace.finish()
 
         if log_scaling:
             self.logger.info(f"Best-matching entry: {best_entry}")
@@ -277,6 +381,11 @@ class LibraryEstimator(AccelergyPlugIn):
             raise ValueError(f"Could not find {target} for {class_name}")
         return Estimation(best_value, "p" if is_energy else "u^2")
 
+    def export_query_traces(self, path: str, fmt: str = "json"):
+        """Writes the recorded query traces to a file. fmt is "json" or
+        "chrome" for the Chrome trace event format."""
+        write_query_traces(self.query_traces, path, fmt)
+
     def get_supported_components(self) -> List[SupportedComponent]:
         supported = []
         for c in self.components:
@@ -0,0 +1,186 @@
+import json
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+# =============================================================================
+# Per-query scaling traces
+# =============================================================================
+"""
+Structured records of how the Library plug-in answered a query: which entries
+were scanned, how many attributes each matched, every scaling step with its
+factor and the time spent in it, and which entry won. Traces are recorded when
+profiling is enabled on the LibraryEstimator and can be exported as plain JSON
+or in the Chrome trace event format (chrome://tracing, Perfetto).
+"""
+
+
+@dataclass
+class ScalingStep:
+    """One attribute scaled from an entry value to a query value."""
+
+    attribute: str
+    scale_from: Optional[float]
+    scale_to: Optional[float]
+    factor: Optional[float]
+    seconds: float
+    error: Optional[str] = None
+    start: float = 0
+
+
+@dataclass
+class EntryTrace:
+    """The work done to check one candidate entry against a query."""
+
+    index: int
+    entry: Dict[str, str]
+    matching_attrs: List[str] = field(default_factory=list)
+    attrs_to_scale: List[str] = field(default_factory=list)
+    scaling_steps: List[ScalingStep] = field(default_factory=list)
+    scale: Optional[float] = None
+    value: Optional[float] = None
+    error: Optional[str] = None
+    start: float = 0
+    seconds: float = 0
+
+    @property
+    def n_matching_attrs(self) -> int:
+        return len(self.matching_attrs)
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.start
+
+
+@dataclass
+class QueryTrace:
+    """The full record of one get_energy_or_area call."""
+
+    class_name: str
+    action_name: Optional[str]
+    target: str
+    class_attrs: Dict[str, Any]
+    support_check: bool
+    entries: List[EntryTrace] = field(default_factory=list)
+    best_index: Optional[int] = None
+    result: Optional[float] = None
+    error: Optional[str] = None
+    start: float = field(default_factory=time.perf_counter)
+    seconds: float = 0
+
+    @property
+    def best_entry(self) -> Optional[EntryTrace]:
+        for e in self.entries:
+            if e.index == self.best_index:
+                return e
+        return None
+
+    def new_entry(self, entry: Dict[str, str]) -> EntryTrace:
+        """Starts tracing a candidate entry and returns its trace."""
+        e = EntryTrace(len(self.entries), entry, start=time.perf_counter())
+        self.entries.append(e)
+        return e
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.start
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = asdict(self)
+        d.pop("start")
+        for e in d["entries"]:
+            e.pop("start")
+            for s in e["scaling_steps"]:
+                s.pop("start")
+            e["n_matching_attrs"] = len(e["matching_attrs"])
+        d["n_entries_scanned"] = len(self.entries)
+        d["class_attrs"] = {k: str(v) for k, v in self.class_attrs.items()}
+        return d
+
+    def to_chrome_events(self, pid: int = 0, tid: int = 0) -> List[Dict[str, Any]]:
+        """Returns Chrome trace "complete" (ph=X) events for this query, its
+        entries, and their scaling steps. Timestamps are in microseconds."""
+        name = self.class_name
+        if self.action_name is not None:
+            name = f"{name}.{self.action_name}"
+
+        def event(name, cat, start, seconds, args):
+            return {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": seconds * 1e6,
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            }
+
+        events = [
+            event(
+                f"{name} {self.target}",
+                "query",
+                self.start,
+                self.seconds,
+                {
+                    "support_check": self.support_check,
+                    "n_entries_scanned": len(self.entries),
+                    "best_index": self.best_index,
+                    "result": self.result,
+                    "error": self.error,
+                },
+            )
+        ]
+        for e in self.entries:
+            events.append(
+                event(
+                    f"entry {e.index}",
+                    "entry",
+                    e.start,
+                    e.seconds,
+                    {
+                        "entry": e.entry,
+                        "n_matching_attrs": e.n_matching_attrs,
+                        "scale": e.scale,
+                        "value": e.value,
+                        "won": e.index == self.best_index,
+                        "error": e.error,
+                    },
+                )
+            )
+            for s in e.scaling_steps:
+                events.append(
+                    event(
+                        f"scale {s.attribute}",
+                        "scaling",
+                        s.start,
+                        s.seconds,
+                        {
+                            "from": s.scale_from,
+                            "to": s.scale_to,
+                            "factor": s.factor,
+                            "error": s.error,
+                        },
+                    )
+                )
+        return events
+
+
+def query_traces_to_json(traces: List[QueryTrace]) -> str:
+    return json.dumps([t.to_dict() for t in traces], indent=2, default=str)
+
+
+def query_traces_to_chrome_trace(traces: List[QueryTrace]) -> str:
+    events = [e for t in traces for e in t.to_chrome_events()]
+    return json.dumps({"traceEvents": events}, default=str)
+
+
+def write_query_traces(traces: List[QueryTrace], path: str, fmt: str = "json"):
+    """Writes query traces to a file. fmt is "json" or "chrome" for the Chrome
+    trace event format."""
+    if fmt == "json":
+        contents = query_traces_to_json(traces)
+    elif fmt == "chrome":
+        contents = query_traces_to_chrome_trace(traces)
+    else:
+        raise ValueError(f'Trace format {fmt} not supported. Use "json" or "chrome".')
+    with open(path, "w") as f:
+        f.write(contents)
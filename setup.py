@@ -12,7 +12,8 @@ data_files = [
     (
         "share/accelergy/estimation_plug_ins/accelergy-library-plugin",
         ["./accelergywrapper.py", "./helper_functions.py",
-         "./scaling.py", "./library.estimator.yaml"],
+         "./scaling.py", "./query_trace.py",
+         "./library.estimator.yaml"],
     ),
 ]
 
@@ -0,0 +1,131 @@
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("accelergy")
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from accelergywrapper import (
+    AccelergyQuery,
+    LibraryEstimator,
+    _export_profiled_query_traces,
+)
+
+MALFORMED_CSV = """\
+technology, width, energy, area, action
+32,         16,    abc,    10,   read|write|update|leak
+"""
+
+# A valid row that wins before the malformed row is reached
+MALFORMED_AFTER_VALID_CSV = """\
+technology, width, energy, area, action
+32,         16,    1,      10,   read|write|update|leak
+32,         *,     abc,    10,   read|write|update|leak
+"""
+
+
+def query(class_name, attrs, action):
+    return AccelergyQuery(class_name, attrs, action, {})
+
+
+@pytest.fixture
+def estimator(monkeypatch):
+    monkeypatch.setenv("ACCELERGY_LIBRARY_PROFILE", "1")
+    monkeypatch.delenv("ACCELERGY_LIBRARY_PROFILE_OUTPUT", raising=False)
+    return LibraryEstimator()
+
+
+def test_profile_disabled(monkeypatch):
+    monkeypatch.delenv("ACCELERGY_LIBRARY_PROFILE", raising=False)
+    s = LibraryEstimator()
+    s.estimate_energy(query("aladdin_adder", {"technology": 32}, "read"))
+    assert s.query_traces == []
+
+
+def test_query_trace(estimator, tmp_path):
+    q = query("aladdin_adder", {"technology": 32, "width": 16}, "read")
+    estimator.primitive_action_supported(q)
+    result = estimator.estimate_energy(q)
+
+    check, trace = estimator.query_traces
+    assert check.support_check and not trace.support_check
+    assert trace.error is None and trace.seconds > 0
+    assert trace.entries and trace.best_entry is not None
+    assert trace.result == pytest.approx(result.value)
+    steps = {s.attribute: s for s in trace.best_entry.scaling_steps}
+    assert steps["width"].factor == pytest.approx(0.5)
+    assert steps["width"].start >= trace.best_entry.start
+
+    json_path = tmp_path / "trace.json"
+    estimator.export_query_traces(str(json_path), "json")
+    traces = json.loads(json_path.read_text())
+    assert len(traces) == 2
+    assert traces[1]["n_entries_scanned"] == len(trace.entries)
+    assert "start" not in traces[1]["entries"][0]["scaling_steps"][0]
+
+    chrome_path = tmp_path / "trace.chrome.json"
+    estimator.export_query_traces(str(chrome_path), "chrome")
+    events = json.loads(chrome_path.read_text())["traceEvents"]
+    assert {e["cat"] for e in events} == {"query", "entry", "scaling"}
+    assert all(e["ph"] == "X" for e in events)
+
+    with pytest.raises(ValueError):
+        estimator.export_query_traces(str(json_path), "csv")
+
+
+def test_malformed_csv_trace(monkeypatch, tmp_path):
+    (tmp_path / "malformed_adder.csv").write_text(MALFORMED_CSV)
+    monkeypatch.setenv("ACCELERGY_COMPONENT_LIBRARIES", str(tmp_path))
+    monkeypatch.setenv("ACCELERGY_LIBRARY_PROFILE", "1")
+    monkeypatch.delenv("ACCELERGY_LIBRARY_PROFILE_OUTPUT", raising=False)
+    s = LibraryEstimator()
+
+    q = query("malformed_adder", {"technology": 32, "width": 16}, "read")
+    with pytest.raises(ValueError):
+        s.estimate_energy(q)
+
+    (trace,) = s.query_traces
+    assert "abc" in trace.error
+    assert trace.result is None and trace.seconds > 0
+    (entry,) = trace.entries
+    assert "abc" in entry.error
+    assert entry.value is None and entry.seconds > 0
+
+
+def test_malformed_csv_after_valid_entry(monkeypatch, tmp_path):
+    (tmp_path / "malformed_adder.csv").write_text(MALFORMED_AFTER_VALID_CSV)
+    monkeypatch.setenv("ACCELERGY_COMPONENT_LIBRARIES", str(tmp_path))
+    monkeypatch.setenv("ACCELERGY_LIBRARY_PROFILE", "1")
+    monkeypatch.delenv("ACCELERGY_LIBRARY_PROFILE_OUTPUT", raising=False)
+    s = LibraryEstimator()
+
+    q = query("malformed_adder", {"technology": 32, "width": 16}, "read")
+    with pytest.raises(ValueError):
+        s.estimate_energy(q)
+
+    (trace,) = s.query_traces
+    assert "abc" in trace.error
+    assert trace.result is None and trace.best_index is None
+    valid, malformed = trace.entries
+    assert valid.value == 1 and valid.error is None
+    assert "abc" in malformed.error
+
+    exported = trace.to_dict()
+    assert exported["result"] is None and exported["best_index"] is None
+
+
+def test_export_profile_output(monkeypatch, tmp_path):
+    path = tmp_path / "trace.json"
+    monkeypatch.setenv("ACCELERGY_LIBRARY_PROFILE", "1")
+    monkeypatch.setenv("ACCELERGY_LIBRARY_PROFILE_OUTPUT", str(path))
+    monkeypatch.setattr("accelergywrapper._PROFILED_ESTIMATORS", [])
+    monkeypatch.setattr("atexit.register", lambda *args: None)
+    a, b = LibraryEstimator(), LibraryEstimator()
+    a.estimate_energy(query("aladdin_adder", {"technology": 32}, "read"))
+    b.estimate_area(query("aladdin_adder", {"technology": 32}, "read"))
+
+    _export_profiled_query_traces(str(path), "json")
+    traces = json.loads(path.read_text())
+    assert [t["target"] for t in traces] == ["energy", "area"]